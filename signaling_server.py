@@ -8,98 +8,202 @@ import asyncio
 import json
 import hashlib
 import base64
+import logging
+import logging.handlers
+import queue
+import re
 import struct
 import socket
 from http.server import BaseHTTPRequestHandler
 from urllib.parse import parse_qs, urlparse
 
+logger = logging.getLogger('signaling')
+
+
+def setup_logging(level=logging.INFO):
+    """Log through a queue so the event loop never blocks on stdout"""
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(level)
+    return listener
+
+# Use orjson for message encoding when available (3-10x faster, emits bytes)
+try:
+    import orjson
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+    _loads = json.loads
+
+# numpy vectorizes the unmask XOR for large payloads when available
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+# Message types relayed to the room without modification; their type and
+# room are sniffed straight out of the message bytes so forwarding skips
+# the JSON parse/serialize round-trip entirely
+_FORWARD_TYPES = frozenset((b'presence', b'offer', b'answer', b'ice-candidate'))
+_TYPE_RE = re.compile(rb'"type"\s*:\s*"([^"]+)"')
+_ROOM_RE = re.compile(rb'"room"\s*:\s*"([^"]+)"')
+
+# Handshake response with only the accept key left to fill in
+_HANDSHAKE_TEMPLATE = (
+    b'HTTP/1.1 101 Switching Protocols\r\n'
+    b'Upgrade: websocket\r\n'
+    b'Connection: Upgrade\r\n'
+    b'Sec-WebSocket-Accept: %b\r\n'
+    b'\r\n'
+)
+
+
+# Pre-compiled frame header structs, shared by parse and build
+_S_BB = struct.Struct('BB')
+_S_H = struct.Struct('>H')
+_S_Q = struct.Struct('>Q')
+
 
 class WebSocketFrame:
     """WebSocket frame parser and builder"""
     
     @staticmethod
-    def parse(data):
-        """Parse a WebSocket frame"""
-        if len(data) < 2:
+    def parse(data, offset=0):
+        """Parse a WebSocket frame starting at offset
+
+        Returns a (fin, opcode, payload, length) tuple, or None if the
+        buffer does not yet hold a complete frame.
+        """
+        available = len(data) - offset
+        if available < 2:
             return None
-            
-        byte1, byte2 = struct.unpack('BB', data[:2])
-        
+
+        byte1, byte2 = _S_BB.unpack_from(data, offset)
+
         fin = (byte1 & 0b10000000) >> 7
         opcode = byte1 & 0b00001111
         masked = (byte2 & 0b10000000) >> 7
         payload_len = byte2 & 0b01111111
-        
-        offset = 2
-        
+
+        cursor = 2
+
         # Extended payload length
         if payload_len == 126:
-            if len(data) < 4:
+            if available < 4:
                 return None
-            payload_len = struct.unpack('>H', data[2:4])[0]
-            offset = 4
+            payload_len = _S_H.unpack_from(data, offset + 2)[0]
+            cursor = 4
         elif payload_len == 127:
-            if len(data) < 10:
+            if available < 10:
                 return None
-            payload_len = struct.unpack('>Q', data[2:10])[0]
-            offset = 10
-        
+            payload_len = _S_Q.unpack_from(data, offset + 2)[0]
+            cursor = 10
+
         # Masking key
         mask_key = None
         if masked:
-            if len(data) < offset + 4:
+            if available < cursor + 4:
                 return None
-            mask_key = data[offset:offset + 4]
-            offset += 4
-        
+            mask_key = data[offset + cursor:offset + cursor + 4]
+            cursor += 4
+
         # Payload
-        if len(data) < offset + payload_len:
+        if available < cursor + payload_len:
             return None
-            
-        payload = data[offset:offset + payload_len]
-        
+
+        start = offset + cursor
+        payload = data[start:start + payload_len]
+
         # Unmask if needed
         if masked and mask_key:
-            payload = bytes([payload[i] ^ mask_key[i % 4] for i in range(len(payload))])
-        
-        return {
-            'fin': fin,
-            'opcode': opcode,
-            'payload': payload,
-            'length': offset + payload_len
-        }
+            payload = WebSocketFrame.unmask(payload, mask_key)
+        else:
+            payload = bytes(payload)
+
+        return fin, opcode, payload, cursor + payload_len
     
+    @staticmethod
+    def unmask(payload, mask_key):
+        """XOR-unmask a payload a word (or a vector) at a time"""
+        length = len(payload)
+        if length < 8:
+            return bytes(payload[i] ^ mask_key[i % 4] for i in range(length))
+
+        # Large payloads: one SIMD-friendly C loop via numpy; below the
+        # threshold the array setup costs more than it saves
+        if _np is not None and length >= 256:
+            arr = _np.frombuffer(payload, dtype=_np.uint8).copy()
+            arr ^= _np.resize(_np.frombuffer(mask_key, dtype=_np.uint8), length)
+            return arr.tobytes()
+
+        # Widen the 4-byte mask to a 64-bit word and XOR in 8-byte chunks
+        mask_word = int.from_bytes(mask_key * 2, 'little')
+        end = length - (length % 8)
+        out = bytearray(length)
+        for i in range(0, end, 8):
+            word = int.from_bytes(payload[i:i + 8], 'little') ^ mask_word
+            out[i:i + 8] = word.to_bytes(8, 'little')
+
+        # Tail shorter than one word
+        for i in range(end, length):
+            out[i] = payload[i] ^ mask_key[i % 4]
+
+        return bytes(out)
+
     @staticmethod
     def build(payload, opcode=0x1):
-        """Build a WebSocket frame"""
-        if isinstance(payload, str):
-            payload = payload.encode('utf-8')
-        
-        frame = bytearray()
-        frame.append(0b10000000 | opcode)  # FIN=1, opcode
-        
+        """Build a WebSocket frame from payload bytes"""
         payload_len = len(payload)
+
+        # Fast path: two-byte header covers typical signaling messages
         if payload_len < 126:
-            frame.append(payload_len)
-        elif payload_len < 65536:
+            return bytes((0b10000000 | opcode, payload_len)) + payload
+
+        frame = bytearray()
+        frame.append(0b10000000 | opcode)  # FIN=1, opcode
+
+        if payload_len < 65536:
             frame.append(126)
-            frame.extend(struct.pack('>H', payload_len))
+            frame.extend(_S_H.pack(payload_len))
         else:
             frame.append(127)
-            frame.extend(struct.pack('>Q', payload_len))
+            frame.extend(_S_Q.pack(payload_len))
         
         frame.extend(payload)
         return bytes(frame)
 
 
+class Client:
+    """Per-connection state, slotted to keep it compact"""
+
+    __slots__ = ('id', 'reader', 'writer', 'peername', 'rooms', 'queue', 'writer_task')
+
+    def __init__(self, client_id, reader, writer):
+        self.id = client_id
+        self.reader = reader
+        self.writer = writer
+        self.peername = writer.get_extra_info('peername')
+        self.rooms = set()
+        self.queue = asyncio.Queue(maxsize=256)
+        self.writer_task = None
+
+
 class SignalingServer:
     """WebSocket signaling server for P2P connections"""
-    
+
+    _MAGIC = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
     def __init__(self, host='0.0.0.0', port=8765):
         self.host = host
         self.port = port
-        self.clients = {}  # websocket -> client_info
-        self.rooms = {}    # room_id -> set of websockets
+        self.clients = {}  # websocket -> Client
+        self.rooms = {}    # room_id -> dict of members (ws -> Client)
         
     async def handle_client(self, reader, writer):
         """Handle a WebSocket client connection"""
@@ -107,105 +211,119 @@ class SignalingServer:
         websocket = None
         
         try:
-            # HTTP handshake
-            request_line = await reader.readline()
-            if not request_line:
+            # Disable Nagle and enable keepalive: signaling frames are tiny
+            # and latency-sensitive
+            sock = writer.get_extra_info('socket')
+            if sock is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+            # HTTP handshake: read the whole header block in one shot
+            try:
+                raw = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
                 return
-            
+
             headers = {}
-            while True:
-                line = await reader.readline()
-                if line == b'\r\n':
-                    break
-                if b':' in line:
-                    key, value = line.decode('utf-8').strip().split(':', 1)
-                    headers[key.strip().lower()] = value.strip()
-            
+            for line in raw.split(b'\r\n')[1:]:  # skip the request line
+                sep = line.find(b':')
+                if sep != -1:
+                    headers[line[:sep].strip().lower()] = line[sep + 1:].strip()
+
             # WebSocket handshake
-            if headers.get('upgrade', '').lower() != 'websocket':
+            if headers.get(b'upgrade', b'').lower() != b'websocket':
                 writer.close()
                 await writer.wait_closed()
                 return
-            
-            websocket_key = headers.get('sec-websocket-key', '')
+
+            websocket_key = headers.get(b'sec-websocket-key', b'')
             accept_key = self.generate_accept_key(websocket_key)
             
-            response = (
-                b'HTTP/1.1 101 Switching Protocols\r\n'
-                b'Upgrade: websocket\r\n'
-                b'Connection: Upgrade\r\n'
-                b'Sec-WebSocket-Accept: ' + accept_key.encode() + b'\r\n'
-                b'\r\n'
-            )
-            
-            writer.write(response)
+            writer.write(_HANDSHAKE_TEMPLATE % accept_key)
             await writer.drain()
             
-            print(f"WebSocket connection established from {writer.get_extra_info('peername')}")
-            
             # Store client
             websocket = writer
             client_id = id(writer)
-            self.clients[websocket] = {
-                'id': client_id,
-                'reader': reader,
-                'writer': writer,
-                'rooms': set()
-            }
+            client = Client(client_id, reader, writer)
+            self.clients[websocket] = client
+            client.writer_task = asyncio.create_task(self._writer_loop(client))
+
+            logger.info("WebSocket connection established from %s", client.peername)
             
             # Handle messages
-            buffer = b''
+            buffer = bytearray()
+            head = 0
             while True:
-                data = await reader.read(4096)
+                data = await reader.read(65536)
                 if not data:
                     break
-                
-                buffer += data
-                
-                while buffer:
-                    frame = WebSocketFrame.parse(buffer)
-                    if not frame:
+
+                buffer.extend(data)
+
+                while head < len(buffer):
+                    frame = WebSocketFrame.parse(buffer, head)
+                    if frame is None:
                         break
-                    
-                    buffer = buffer[frame['length']:]
-                    
+
+                    fin, opcode, payload, length = frame
+                    head += length
+
                     # Handle frame
-                    if frame['opcode'] == 0x8:  # Close
+                    if opcode == 0x8:  # Close
                         await self.close_connection(websocket)
                         return
-                    elif frame['opcode'] == 0x9:  # Ping
-                        pong = WebSocketFrame.build(frame['payload'], opcode=0xA)
-                        writer.write(pong)
-                        await writer.drain()
-                    elif frame['opcode'] == 0x1:  # Text
-                        await self.handle_message(websocket, frame['payload'].decode('utf-8'))
-        
-        except Exception as e:
-            print(f"Error handling client: {e}")
+                    elif opcode == 0x9:  # Ping
+                        pong = WebSocketFrame.build(payload, opcode=0xA)
+                        self._enqueue(client, pong)
+                    elif opcode == 0x1:  # Text
+                        await self.handle_message(websocket, payload)
+
+                # Compact the consumed prefix only once it grows large
+                if head >= len(buffer):
+                    buffer.clear()
+                    head = 0
+                elif head > 65536:
+                    del buffer[:head]
+                    head = 0
+
+        except OSError as e:
+            logger.error("Error handling client: %s", e)
         finally:
             if websocket:
                 await self.close_connection(websocket)
     
     def generate_accept_key(self, key):
-        """Generate WebSocket accept key"""
-        magic = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
-        sha1 = hashlib.sha1((key + magic).encode()).digest()
-        return base64.b64encode(sha1).decode()
+        """Generate WebSocket accept key from the raw header bytes"""
+        sha1 = hashlib.sha1(key)
+        sha1.update(self._MAGIC)
+        return base64.b64encode(sha1.digest())
     
     async def handle_message(self, websocket, message):
         """Handle incoming WebSocket message"""
         try:
-            data = json.loads(message)
+            # Fast path: forward relayed types verbatim
+            type_match = _TYPE_RE.search(message)
+            if type_match and type_match.group(1) in _FORWARD_TYPES:
+                room_match = _ROOM_RE.search(message)
+                room_id = room_match.group(1).decode('utf-8') if room_match else 'default'
+                self.broadcast_to_room_raw(room_id, message, exclude=websocket)
+                return
+
+            data = _loads(message)
+            if not isinstance(data, dict):
+                logger.warning("Non-object JSON received: %s", message)
+                return
             msg_type = data.get('type')
             
             if msg_type == 'join':
                 # Join a room
                 room_id = data.get('room', 'default')
                 if room_id not in self.rooms:
-                    self.rooms[room_id] = set()
-                self.rooms[room_id].add(websocket)
-                self.clients[websocket]['rooms'].add(room_id)
-                print(f"Client joined room: {room_id}")
+                    self.rooms[room_id] = {}
+                self.rooms[room_id][websocket] = self.clients[websocket]
+                self.clients[websocket].rooms.add(room_id)
+                logger.info("Client joined room: %s", room_id)
                 
                 # Send confirmation
                 await self.send_to_client(websocket, {
@@ -214,78 +332,111 @@ class SignalingServer:
                 })
                 
             elif msg_type in ['presence', 'offer', 'answer', 'ice-candidate']:
-                # Broadcast to room
+                # Broadcast to room (fallback when the byte sniff missed)
                 room_id = data.get('room', 'default')
                 if room_id in self.rooms:
                     await self.broadcast_to_room(room_id, data, exclude=websocket)
                     
-        except json.JSONDecodeError:
-            print(f"Invalid JSON received: {message}")
-        except Exception as e:
-            print(f"Error handling message: {e}")
+        except ValueError:
+            logger.warning("Invalid JSON received: %s", message)
     
+    async def _writer_loop(self, client):
+        """Drain a client's outbound queue, coalescing adjacent frames"""
+        writer = client.writer
+        queue = client.queue
+        try:
+            while True:
+                frame = await queue.get()
+
+                # Coalesce whatever else is already queued into one write
+                if not queue.empty():
+                    frames = [frame]
+                    while not queue.empty():
+                        frames.append(queue.get_nowait())
+                    frame = b''.join(frames)
+
+                writer.write(frame)
+                await writer.drain()
+        except OSError as e:
+            logger.debug("Error writing to client: %s", e)
+            writer.close()
+
+    def _enqueue(self, client, frame):
+        """Queue a frame for a client, disconnecting it if backed up"""
+        try:
+            client.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            logger.info("Client %s too slow, disconnecting", client.peername)
+            client.writer.close()
+
     async def send_to_client(self, websocket, data):
         """Send message to a specific client"""
-        try:
-            message = json.dumps(data)
-            frame = WebSocketFrame.build(message)
-            websocket.write(frame)
-            await websocket.drain()
-        except Exception as e:
-            print(f"Error sending to client: {e}")
-    
+        client = self.clients.get(websocket)
+        if client is None:
+            return
+
+        frame = WebSocketFrame.build(_dumps(data))
+        self._enqueue(client, frame)
+
     async def broadcast_to_room(self, room_id, data, exclude=None):
         """Broadcast message to all clients in a room"""
-        if room_id not in self.rooms:
+        self.broadcast_to_room_raw(room_id, _dumps(data), exclude=exclude)
+
+    def broadcast_to_room_raw(self, room_id, payload, exclude=None):
+        """Broadcast pre-encoded message bytes to all clients in a room"""
+        room = self.rooms.get(room_id)
+        if not room:
             return
-        
-        message = json.dumps(data)
-        frame = WebSocketFrame.build(message)
-        
-        for client_ws in self.rooms[room_id]:
-            if client_ws != exclude and client_ws in self.clients:
-                try:
-                    client_ws.write(frame)
-                    await client_ws.drain()
-                except Exception as e:
-                    print(f"Error broadcasting to client: {e}")
+
+        frame = WebSocketFrame.build(payload)
+
+        # Snapshot membership so a disconnect during fan-out cannot mutate
+        # the room mid-iteration
+        targets = tuple(client for ws, client in room.items() if ws is not exclude)
+        for client in targets:
+            self._enqueue(client, frame)
     
     async def close_connection(self, websocket):
         """Close a client connection"""
         if websocket not in self.clients:
             return
         
-        client_info = self.clients[websocket]
-        
+        client = self.clients[websocket]
+
         # Remove from rooms
-        for room_id in client_info['rooms']:
+        for room_id in client.rooms:
             if room_id in self.rooms:
-                self.rooms[room_id].discard(websocket)
+                self.rooms[room_id].pop(websocket, None)
                 if not self.rooms[room_id]:
                     del self.rooms[room_id]
         
         # Remove client
         del self.clients[websocket]
-        
+
+        # Stop the outbound writer
+        if client.writer_task is not None:
+            client.writer_task.cancel()
+
         try:
             websocket.close()
             await websocket.wait_closed()
-        except:
+        except OSError:
             pass
         
-        print(f"Client disconnected")
+        logger.info("Client %s disconnected", client.peername)
     
     async def start(self):
         """Start the signaling server"""
         server = await asyncio.start_server(
             self.handle_client,
             self.host,
-            self.port
+            self.port,
+            limit=1 << 20
         )
         
         addr = server.sockets[0].getsockname()
-        print(f"Signaling server listening on {addr[0]}:{addr[1]}")
-        print(f"Clients should connect to: ws://{self.get_local_ip()}:{addr[1]}")
+        logger.info("Signaling server listening on %s:%s", addr[0], addr[1])
+        logger.info("Clients should connect to: ws://%s:%s", self.get_local_ip(), addr[1])
         
         async with server:
             await server.serve_forever()
@@ -298,7 +449,7 @@ class SignalingServer:
             ip = s.getsockname()[0]
             s.close()
             return ip
-        except:
+        except OSError:
             return self.host
 
 
@@ -324,4 +475,13 @@ if __name__ == '__main__':
     print("=" * 60)
     print("P2P Kanban Signaling Server")
     print("=" * 60)
+    setup_logging()
+
+    # Use uvloop when available for faster transports
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
     asyncio.run(main())